@@ -8,18 +8,223 @@ Author: Frank Wittig <frank@e5k.de>
 Source: https://github.com/elias5000/check_rds_mysql
 """
 
+import os
+import pickle
+import re
 import sys
+import time
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-
-import boto3
-from botocore.exceptions import BotoCoreError, ClientError
+from functools import cached_property, lru_cache
+from operator import itemgetter
+from typing import NamedTuple
 
 STATE_OK = 0
 STATE_WARN = 1
 STATE_CRIT = 2
 STATE_UNKNOWN = 3
 
+# order in which states take precedence for the overall result
+STATE_PRIORITY = {STATE_OK: 0, STATE_UNKNOWN: 1, STATE_WARN: 2, STATE_CRIT: 3}
+STATE_TEXT = {
+    STATE_OK: 'OK:',
+    STATE_WARN: 'WARNING:',
+    STATE_CRIT: 'CRITICAL:',
+    STATE_UNKNOWN: 'UNKNOWN:',
+}
+
+UNIT_RE = re.compile(r'^(\d+)(Ki|Mi|Gi|K|M|G)?$')
+UNIT_MULTIPLIERS = {
+    'K': 1000,
+    'Ki': 1024,
+    'M': 1000000,
+    'Mi': 1048576,
+    'G': 1000000000,
+    'Gi': 1073741824,
+    None: 1,
+}
+
+# bare parameter formula, e.g. {DBInstanceClassMemory/12582880}
+FORMULA_RE = re.compile(r'\{([A-Za-z]+)/(\d+)\}')
+
+CACHE_DIR = os.path.expanduser('~/.cache/check_rds_mysql')
+INSTANCE_TTL = 300
+PARAMETERS_TTL = 3600
+INSTANCE_TYPE_TTL = 86400
+
+# memory of common RDS instance classes as reported by ec2 describe-instance-types
+INSTANCE_MEMORY_MIB = {
+    't2.micro': 1024,
+    't2.small': 2048,
+    't2.medium': 4096,
+    't2.large': 8192,
+    't2.xlarge': 16384,
+    't2.2xlarge': 32768,
+    't3.micro': 1024,
+    't3.small': 2048,
+    't3.medium': 4096,
+    't3.large': 8192,
+    't3.xlarge': 16384,
+    't3.2xlarge': 32768,
+    't4g.micro': 1024,
+    't4g.small': 2048,
+    't4g.medium': 4096,
+    't4g.large': 8192,
+    't4g.xlarge': 16384,
+    't4g.2xlarge': 32768,
+    'm4.large': 8192,
+    'm4.xlarge': 16384,
+    'm4.2xlarge': 32768,
+    'm4.4xlarge': 65536,
+    'm4.10xlarge': 163840,
+    'm4.16xlarge': 262144,
+    'm5.large': 8192,
+    'm5.xlarge': 16384,
+    'm5.2xlarge': 32768,
+    'm5.4xlarge': 65536,
+    'm5.8xlarge': 131072,
+    'm5.12xlarge': 196608,
+    'm5.16xlarge': 262144,
+    'm5.24xlarge': 393216,
+    'm6g.large': 8192,
+    'm6g.xlarge': 16384,
+    'm6g.2xlarge': 32768,
+    'm6g.4xlarge': 65536,
+    'm6g.8xlarge': 131072,
+    'm6g.12xlarge': 196608,
+    'm6g.16xlarge': 262144,
+    'm6i.large': 8192,
+    'm6i.xlarge': 16384,
+    'm6i.2xlarge': 32768,
+    'm6i.4xlarge': 65536,
+    'm6i.8xlarge': 131072,
+    'm6i.12xlarge': 196608,
+    'm6i.16xlarge': 262144,
+    'm6i.24xlarge': 393216,
+    'm6i.32xlarge': 524288,
+    'r4.large': 15616,
+    'r4.xlarge': 31232,
+    'r4.2xlarge': 62464,
+    'r4.4xlarge': 124928,
+    'r4.8xlarge': 249856,
+    'r4.16xlarge': 499712,
+    'r5.large': 16384,
+    'r5.xlarge': 32768,
+    'r5.2xlarge': 65536,
+    'r5.4xlarge': 131072,
+    'r5.8xlarge': 262144,
+    'r5.12xlarge': 393216,
+    'r5.16xlarge': 524288,
+    'r5.24xlarge': 786432,
+    'r6g.large': 16384,
+    'r6g.xlarge': 32768,
+    'r6g.2xlarge': 65536,
+    'r6g.4xlarge': 131072,
+    'r6g.8xlarge': 262144,
+    'r6g.12xlarge': 393216,
+    'r6g.16xlarge': 524288,
+    'r6i.large': 16384,
+    'r6i.xlarge': 32768,
+    'r6i.2xlarge': 65536,
+    'r6i.4xlarge': 131072,
+    'r6i.8xlarge': 262144,
+    'r6i.12xlarge': 393216,
+    'r6i.16xlarge': 524288,
+    'r6i.24xlarge': 786432,
+    'r6i.32xlarge': 1048576,
+}
+
+# botocore is imported on first use to keep --help and usage errors fast
+CLIENT_CONFIG = {
+    'user_agent_extra': 'check_rds_mysql',
+    'max_pool_connections': 4,
+    # fail fast instead of running into the Nagios check timeout on a stalled endpoint
+    'connect_timeout': 2,
+    'read_timeout': 4,
+    'retries': {'max_attempts': 2, 'mode': 'adaptive'},
+}
+
+
+@lru_cache(maxsize=None)
+def _session():
+    """
+    Return shared botocore session
+    :return:
+    """
+    import botocore.session  # pylint: disable=import-outside-toplevel
+    return botocore.session.get_session()
+
+
+@lru_cache(maxsize=None)
+def _client(service, region):
+    """
+    Return shared service client for region
+    :param service:
+    :param region:
+    :return:
+    """
+    from botocore.config import Config  # pylint: disable=import-outside-toplevel
+    return _session().create_client(service, config=Config(region_name=region, **CLIENT_CONFIG))
+
+
+def _cache_path(key):
+    """
+    Return path of cache file for key
+    :param key:
+    :return:
+    """
+    return os.path.join(CACHE_DIR, '{}.pkl'.format(key))
+
+
+def _cache_fresh(key, ttl):
+    """
+    Return True if cache entry for key is younger than ttl seconds
+    :param key:
+    :param ttl:
+    :return:
+    """
+    try:
+        return time.time() - os.path.getmtime(_cache_path(key)) < ttl
+    except OSError:
+        return False
+
+
+def _cached(key, ttl, func):
+    """
+    Return result of func, cached on disk for ttl seconds
+    :param key:
+    :param ttl:
+    :param func:
+    :return:
+    """
+    path = _cache_path(key)
+    try:
+        if _cache_fresh(key, ttl):
+            with open(path, 'rb') as cache_file:
+                return pickle.load(cache_file)
+    except (OSError, pickle.PickleError, EOFError):
+        pass
+
+    result = func()
+    try:
+        # write to a temporary file first so concurrent checks never read partial data
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open('{}.{}'.format(path, os.getpid()), 'wb') as cache_file:
+            pickle.dump(result, cache_file)
+        os.replace(cache_file.name, path)
+    except OSError:
+        pass
+    return result
+
+
+class State(NamedTuple):
+    """ Check result of a single metric """
+    name: str
+    state: int
+    value: str
+    unit: str
+
 
 class DbInstance:
     """ Database instance object """
@@ -28,27 +233,51 @@ class DbInstance:
         self.region = region
         self.db_instance_identifier = db_instance_identifier
 
-        rds = boto3.session.Session(region_name=self.region).client('rds')
-        self.data = \
-            rds.describe_db_instances(DBInstanceIdentifier=self.db_instance_identifier)[
-                'DBInstances'][
-                0]
-        self.parameters = self.fetch_parameters()
-        self.instance_class = self.fetch_instance_class()
+        self.data = _cached(
+            'rds-{}-{}'.format(self.region, self.db_instance_identifier), INSTANCE_TTL,
+            lambda: self.rds.describe_db_instances(
+                DBInstanceIdentifier=self.db_instance_identifier)['DBInstances'][0]
+        )
+
+    @cached_property
+    def rds(self):
+        # created on first use so a full cache hit never loads the rds service model
+        return _client('rds', self.region)
 
     @property
     def parameter_group_name(self):
         return self.data['DBParameterGroups'][0]['DBParameterGroupName']
 
-    def fetch_parameters(self):
-        rds = boto3.session.Session(region_name=self.region).client('rds')
-        paginator = rds.get_paginator('describe_db_parameters')
-        res = paginator.paginate(DBParameterGroupName=self.parameter_group_name)
-        params = {}
-        for page in res:
-            for param in page['Parameters']:
-                params[param['ParameterName']] = param
-        return params
+    def fetch_parameters(self, source=None, rds=None):
+        # only max_connections is used, so stop paging as soon as it is found
+        rds = rds or _client('rds', self.region)
+        kwargs = {'DBParameterGroupName': self.parameter_group_name, 'MaxRecords': 100}
+        if source:
+            kwargs['Source'] = source
+        while True:
+            res = rds.describe_db_parameters(**kwargs)
+            for param in res['Parameters']:
+                if param['ParameterName'] == 'max_connections':
+                    return {'max_connections': param}
+            if not res.get('Marker'):
+                return {}
+            kwargs['Marker'] = res['Marker']
+
+    @property
+    def parameters_cache_key(self):
+        return 'params-{}-{}'.format(self.region, self.parameter_group_name)
+
+    @cached_property
+    def parameters(self):
+        def fetch():
+            # user modified parameters are a small set, only scan all if
+            # max_connections is default
+            params = self.fetch_parameters(source='user', rds=self.rds)
+            if 'max_connections' not in params:
+                params = self.fetch_parameters(rds=self.rds)
+            return params
+
+        return _cached(self.parameters_cache_key, PARAMETERS_TTL, fetch)
 
     def parameter(self, which):
         try:
@@ -60,26 +289,61 @@ class DbInstance:
     def instance_class_name(self):
         return self.data['DBInstanceClass']
 
-    def fetch_instance_class(self):
-        instance_class_name = self.instance_class_name
-        if instance_class_name.startswith('db.'):
-            instance_class_name = '.'.join(self.instance_class_name.split('.')[1:])
-        ec2 = boto3.session.Session(region_name=self.region).client('ec2')
-        return ec2.describe_instance_types(InstanceTypes=[instance_class_name])['InstanceTypes'][0]
+    @property
+    def instance_type(self):
+        if self.instance_class_name.startswith('db.'):
+            return '.'.join(self.instance_class_name.split('.')[1:])
+        return self.instance_class_name
+
+    def fetch_instance_class(self, ec2=None):
+        ec2 = ec2 or _client('ec2', self.region)
+        return ec2.describe_instance_types(InstanceTypes=[self.instance_type])['InstanceTypes'][0]
 
     @property
-    def instance_memory(self):
-        return self.instance_class['MemoryInfo']['SizeInMiB'] * 1024 * 1024
+    def instance_type_cache_key(self):
+        return 'itype-{}'.format(self.instance_type)
 
     @property
+    def instance_memory_known(self):
+        return self.instance_type in INSTANCE_MEMORY_MIB or \
+            _cache_fresh(self.instance_type_cache_key, INSTANCE_TYPE_TTL)
+
+    @cached_property
+    def instance_memory_mib(self):
+        if self.instance_type in INSTANCE_MEMORY_MIB:
+            return INSTANCE_MEMORY_MIB[self.instance_type]
+
+        return _cached(self.instance_type_cache_key, INSTANCE_TYPE_TTL,
+                       lambda: self.fetch_instance_class()['MemoryInfo']['SizeInMiB'])
+
+    @property
+    def instance_memory(self):
+        return self.instance_memory_mib * 1024 * 1024
+
+    @cached_property
     def max_connections(self):
+        memory = None
+        if not _cache_fresh(self.parameters_cache_key, PARAMETERS_TTL) and \
+                not self.instance_memory_known:
+            # both lookups are api calls and the default value usually needs instance
+            # memory, so run them concurrently. sessions are not thread-safe, so create
+            # the clients before fanning out
+            self.rds  # pylint: disable=pointless-statement
+            _client('ec2', self.region)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                parameters = executor.submit(lambda: self.parameters)
+                memory = executor.submit(lambda: self.instance_memory_mib)
+                parameters.result()
         value = self.parameter('max_connections')
-        if value.startswith('{'):
-            param, divisor = value.split('{')[1].split('}')[0].split('/')
-            if param == 'DBInstanceClassMemory':
-                return int(self.instance_memory / int(divisor))
-            raise RuntimeError('Cannot compute value "%2"', value)
-        return int(value)
+        match = FORMULA_RE.fullmatch(value)
+        if not match:
+            return int(value)
+        param, divisor = match.group(1), int(match.group(2))
+        if param == 'DBInstanceClassMemory':
+            if memory is not None:
+                memory.result()
+            return int(self.instance_memory / divisor)
+        raise RuntimeError(f'Cannot compute value "{value}"')
 
     @property
     def storage(self):
@@ -100,20 +364,6 @@ class Metric:
         self.region = kwargs.get('region', 'eu-central-1')
         self.statistics = kwargs.get('statistics', 'Average')
 
-    def get_client(self):
-        """
-        Return cloudwatch client for region
-        :return:
-        """
-        return boto3.session.Session(region_name=self.region).resource('cloudwatch')
-
-    def get_metric(self):
-        """
-        Return metric resource by name
-        :return:
-        """
-        return self.get_client().Metric("{}/{}".format(self.prefix, self.namespace), self.name)
-
     def get_dimensions(self):
         """
         Return dimensions for request
@@ -131,34 +381,35 @@ class Metric:
             })
         return dimensions
 
-    def get_statistics(self, metric=None, offset=0):
+    def get_statistics(self):
         """
-        Return statistics for resource
-        :param metric:
-        :param offset:
+        Return statistics for metric
         :return:
         """
-        if offset > 20:
-            return None
-
-        if metric is None:
-            metric = self.get_metric()
+        # pylint: disable=import-outside-toplevel
+        from botocore.exceptions import (BotoCoreError, ClientError, ConnectTimeoutError,
+                                         ReadTimeoutError)
 
+        # query the whole look-back window at once instead of stepping back minute by minute
+        now = datetime.utcnow()
+        minutes = self.minutes + 20 if self.last_state else self.minutes
         try:
-            statistics = metric.get_statistics(
+            statistics = _client('cloudwatch', self.region).get_metric_statistics(
+                Namespace="{}/{}".format(self.prefix, self.namespace),
+                MetricName=self.name,
                 Dimensions=self.get_dimensions(),
-                StartTime=self.start_time(offset),
-                EndTime=self.end_time(offset),
+                StartTime=now - timedelta(minutes=minutes),
+                EndTime=now,
                 Period=300,
                 Statistics=[self.statistics]
             )
+        except (ConnectTimeoutError, ReadTimeoutError):
+            print("UNKNOWN - timeout")
+            sys.exit(STATE_UNKNOWN)
         except (BotoCoreError, ClientError) as err:
             print("UNKNOWN - {}".format(err))
             sys.exit(STATE_UNKNOWN)
 
-        if not statistics['Datapoints'] and self.last_state:
-            statistics = self.get_statistics(metric, offset + 1)
-
         return statistics
 
     def get_current_value(self):
@@ -170,24 +421,71 @@ class Metric:
         if not statistics['Datapoints']:
             return None
 
-        return statistics['Datapoints'][-1][self.statistics]
+        return max(statistics['Datapoints'], key=itemgetter('Timestamp'))[self.statistics]
 
-    def start_time(self, offset=0):
-        """
-        Return start time
-        :param offset:
-        :return:
-        """
-        return datetime.utcnow() - timedelta(minutes=(self.minutes + offset))
 
-    @staticmethod
-    def end_time(offset=0):
-        """
-        Return end time
-        :param offset:
-        :return:
-        """
-        return datetime.utcnow() - timedelta(minutes=offset)
+def metric_query(query_id, instance_id, name):
+    """
+    Return GetMetricData query for RDS instance metric
+    :param query_id:
+    :param instance_id:
+    :param name:
+    :return:
+    """
+    return {
+        'Id': query_id,
+        'MetricStat': {
+            'Metric': {
+                'Namespace': 'AWS/RDS',
+                'MetricName': name,
+                'Dimensions': [{'Name': 'DBInstanceIdentifier', 'Value': instance_id}]
+            },
+            # RDS publishes these metrics every minute, so each period holds a single sample
+            'Period': 60,
+            'Stat': 'Average'
+        }
+    }
+
+
+def fetch_all(region, instance_id, last_state):
+    """
+    Return latest connections, storage and cpu values in a single request
+    :param region:
+    :param instance_id:
+    :param last_state:
+    :return:
+    """
+    queries = [
+        metric_query('conns', instance_id, 'DatabaseConnections'),
+        metric_query('storage', instance_id, 'FreeStorageSpace'),
+        metric_query('cpu', instance_id, 'CPUUtilization'),
+    ]
+    # pylint: disable=import-outside-toplevel
+    from botocore.exceptions import (BotoCoreError, ClientError, ConnectTimeoutError,
+                                     ReadTimeoutError)
+
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(minutes=25 if last_state else 5)
+
+    try:
+        response = _client('cloudwatch', region).get_metric_data(
+            MetricDataQueries=queries,
+            StartTime=start_time,
+            EndTime=end_time,
+            ScanBy='TimestampDescending'
+        )
+    except (ConnectTimeoutError, ReadTimeoutError):
+        print("UNKNOWN - timeout")
+        sys.exit(STATE_UNKNOWN)
+    except (BotoCoreError, ClientError) as err:
+        print("UNKNOWN - {}".format(err))
+        sys.exit(STATE_UNKNOWN)
+
+    values = {query['Id']: None for query in queries}
+    for result in response['MetricDataResults']:
+        if result['Values']:
+            values[result['Id']] = result['Values'][0]
+    return values
 
 
 def compare_range(value, window):
@@ -235,69 +533,41 @@ def compare(value, warn, crit):
     return STATE_OK
 
 
-def unused_connections(args):
+def unused_connections(args, instance, values):
     """
     Return available connections
     :param args:
+    :param instance:
+    :param values:
     :return:
     """
-    instance = DbInstance(args.region, args.instance)
-    metric = Metric(
-        dimensions='DBInstanceIdentifier:{}'.format(args.instance),
-        last_state=args.last_state,
-        minutes=5,
-        name='DatabaseConnections',
-        namespace='RDS',
-        prefix='AWS',
-        region=args.region,
-        statistics='Minimum'
-    )
-    value = instance.max_connections - metric.get_current_value()
+    value = instance.max_connections - values['conns']
     if args.percent:
         return value / instance.max_connections * 100, 100
     return value, instance.max_connections
 
 
-def free_storage(args):
+def free_storage(args, instance, values):
     """
     Return free storage
     :param args:
+    :param instance:
+    :param values:
     :return:
     """
-    instance = DbInstance(args.region, args.instance)
-    metric = Metric(
-        dimensions='DBInstanceIdentifier:{}'.format(args.instance),
-        last_state=args.last_state,
-        minutes=5,
-        name='FreeStorageSpace',
-        namespace='RDS',
-        prefix='AWS',
-        region=args.region,
-        statistics='Minimum'
-    )
-    value = metric.get_current_value()
+    value = values['storage']
     if args.percent:
         return value / instance.storage * 100, 100
     return value, instance.storage
 
 
-def cpu_used(args):
+def cpu_used(values):
     """
     Return cpu used
-    :param args:
+    :param values:
     :return:
     """
-    metric = Metric(
-        dimensions='DBInstanceIdentifier:{}'.format(args.instance),
-        last_state=args.last_state,
-        minutes=5,
-        name='CPUUtilization',
-        namespace='RDS',
-        prefix='AWS',
-        region=args.region,
-        statistics='Maximum'
-    )
-    return metric.get_current_value()
+    return values['cpu']
 
 
 def swap_used(args):
@@ -329,19 +599,10 @@ def expand_unit(value):
         return value
     if ":" in value:
         return ":".join(str(expand_unit(val)) for val in value.split(':'))
-    if value.endswith('K'):
-        value = int(value[:-1]) * 1000
-    elif value.endswith('Ki'):
-        value = int(value[:-2]) * 1024
-    elif value.endswith('M'):
-        value = int(value[:-1]) * 1000000
-    elif value.endswith('Mi'):
-        value = int(value[:-2]) * 1048576
-    elif value.endswith('G'):
-        value = int(value[:-1]) * 1000000000
-    elif value.endswith('Gi'):
-        value = int(value[:-2]) * 1073741824
-    return str(value)
+    match = UNIT_RE.match(value)
+    if not match:
+        return value
+    return str(int(match.group(1)) * UNIT_MULTIPLIERS[match.group(2)])
 
 
 def main():
@@ -376,71 +637,73 @@ thresholds and ranges:
     states = []
     perf_data = []
 
+    # pylint: disable=import-outside-toplevel
+    from botocore.exceptions import ConnectTimeoutError, ReadTimeoutError
+
     # gather metrics
-    value, upper_limit = unused_connections(args)
+    try:
+        instance = DbInstance(args.region, args.instance)
+        # resolve the lazy parameter and instance type lookups while timeouts are handled
+        instance.max_connections  # pylint: disable=pointless-statement
+    except (ConnectTimeoutError, ReadTimeoutError):
+        print("UNKNOWN - timeout")
+        sys.exit(STATE_UNKNOWN)
+    values = fetch_all(args.region, args.instance, args.last_state)
+
+    value, upper_limit = unused_connections(args, instance, values)
     unit = '%' if args.percent else ''
-    states.append({
-        'name': 'free_connections',
-        'state': STATE_UNKNOWN if value is None else compare(value, args.warn_conns,
-                                                             args.crit_conns),
-        'value': int(value),
-        'unit': unit,
-    })
+    states.append(State(
+        name='free_connections',
+        state=STATE_UNKNOWN if value is None else compare(value, args.warn_conns,
+                                                          args.crit_conns),
+        value=str(int(value)),
+        unit=unit
+    ))
     perf_data.append(f'free_connections={int(value)}{unit};'
                      f'{args.warn_conns};{args.crit_conns};'
                      f'0;{upper_limit}')
 
-    value, upper_limit = free_storage(args)
-    states.append({
-        'name': 'free_storage',
-        'state': STATE_UNKNOWN if value is None else compare(
+    value, upper_limit = free_storage(args, instance, values)
+    states.append(State(
+        name='free_storage',
+        state=STATE_UNKNOWN if value is None else compare(
             value, expand_unit(args.warn_disk), expand_unit(args.crit_disk)),
-        'value': f'{(value if args.percent else value / 1024 / 1024):.2f}',
-        'unit': '%' if args.percent else 'MiB',
-    })
+        value=f'{(value if args.percent else value / 1024 / 1024):.2f}',
+        unit='%' if args.percent else 'MiB'
+    ))
     perf_data.append(f'free_storage={int(value)}{"%" if args.percent else ""};'
                      f'{expand_unit(args.warn_disk)};'
                      f'{expand_unit(args.crit_disk)};'
                      f'0;{upper_limit}')
 
-    value = cpu_used(args)
-    states.append({
-        'name': 'cpu_used',
-        'state': STATE_UNKNOWN if value is None else compare(value, args.warn_cpu, args.crit_cpu),
-        'value': f'{value:.2f}',
-        'unit': '%',
-    })
+    value = cpu_used(values)
+    states.append(State(
+        name='cpu_used',
+        state=STATE_UNKNOWN if value is None else compare(value, args.warn_cpu, args.crit_cpu),
+        value=f'{value:.2f}',
+        unit='%'
+    ))
     perf_data.append(
         f'cpu_used={value:.2f}%;{args.warn_cpu};{args.crit_cpu}')
 
     value = swap_used(args)
-    states.append({
-        'name': 'swap_used',
-        'state': STATE_UNKNOWN if value is None else compare(
+    states.append(State(
+        name='swap_used',
+        state=STATE_UNKNOWN if value is None else compare(
             value, expand_unit(args.warn_swap), expand_unit(args.crit_swap)),
-        'value': f'{(value / 1024 / 1024):.2f}',
-        'unit': 'MiB',
-    })
+        value=f'{(value / 1024 / 1024):.2f}',
+        unit='MiB'
+    ))
     perf_data.append(f'swap_used={int(expand_unit(value))};'
                      f'{expand_unit(args.warn_swap)};{expand_unit(args.crit_swap)}')
 
     # determine overall state
-    final_state = STATE_OK
-    final_text = 'OK:'
-    if [item for item in states if item['state'] == STATE_CRIT]:
-        final_state = STATE_CRIT
-        final_text = 'CRITICAL:'
-    elif [item for item in states if item['state'] == STATE_WARN]:
-        final_state = STATE_WARN
-        final_text = 'WARNING:'
-    elif [item for item in states if item['state'] == STATE_UNKNOWN]:
-        final_state = STATE_UNKNOWN
-        final_text = 'UNKNOWN:'
+    final_state = max((item.state for item in states), key=STATE_PRIORITY.get)
+    final_text = STATE_TEXT[final_state]
 
     print(
         final_text,
-        ', '.join(["{}:{}{}".format(item['name'], item['value'], item['unit'])
-                   for item in states]),
+        ', '.join(f'{item.name}:{item.value}{item.unit}' for item in states),
         '|',
         ', '.join(perf_data)
     )